@@ -1,19 +1,32 @@
 # fastapi_app.py
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import sys
 import os
 from datetime import datetime
 import uuid
+import json
+import pickle
+import asyncio
+from collections import defaultdict
+from itertools import islice
+from contextlib import asynccontextmanager
 import logging
+import redis.asyncio as redis
+from redis.exceptions import LockError
+from cachetools import TTLCache
 
 # Add the app directory to the path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
 
 # Import your existing components
 from app.agents import app as agent_app
+from app.config import REDIS_URL, MAX_SESSIONS
+from app.retriever import get_retriever
+from app.models import enable_llm_cache
 from langchain_core.messages import HumanMessage, AIMessage
 
 # Configure logging
@@ -38,8 +51,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory storage for chat sessions (use Redis/DB in production)
-chat_sessions: Dict[str, Dict[str, Any]] = {}
+# Session storage: Redis hashes keyed by session ID when REDIS_URL is set,
+# otherwise an in-memory cache (only safe with a single worker). Either way
+# sessions expire SESSION_TTL_SECONDS after their last write; the in-memory
+# cache also evicts the least recently used session beyond MAX_SESSIONS.
+SESSION_KEY_PREFIX = "sess:"
+SESSION_TTL_SECONDS = 24 * 3600
+SESSION_LOCK_PRUNE_INTERVAL_SECONDS = 3600
+# Cross-worker session locks auto-expire after this long (comfortably above
+# one agent turn) so a crashed worker can't block a session forever
+SESSION_LOCK_KEY_PREFIX = "lock:"
+SESSION_LOCK_TIMEOUT_SECONDS = 300
+chat_sessions: TTLCache = TTLCache(maxsize=MAX_SESSIONS, ttl=SESSION_TTL_SECONDS)
+
+# Display name of the source behind each tool
+TOOL_SOURCES = {"pdf_search": "PDF Documents", "web_search": "Web Search"}
+
+# Shape of a new session; copied and filled in by open_session
+_SESSION_TEMPLATE: Dict[str, Any] = {
+    "messages": None,
+    "agent_state": None,
+    "created_at": None,
+    "last_activity": None,
+    "message_count": 0
+}
+
+# Serializes overlapping requests for the same session within this process;
+# different sessions still run in parallel
+session_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
 
 # Request/Response models
 class ChatMessage(BaseModel):
@@ -63,6 +102,10 @@ class SessionInfo(BaseModel):
     message_count: int
     last_activity: datetime
 
+class SessionPage(BaseModel):
+    items: List[SessionInfo]
+    next_cursor: Optional[int] = None
+
 class HealthCheck(BaseModel):
     status: str
     timestamp: datetime
@@ -73,36 +116,228 @@ def create_session_id() -> str:
     """Generate a unique session ID"""
     return str(uuid.uuid4())
 
-def get_or_create_session(session_id: Optional[str] = None) -> str:
-    """Get existing session or create new one"""
-    if session_id and session_id in chat_sessions:
-        chat_sessions[session_id]["last_activity"] = datetime.now()
-        return session_id
+def session_key(session_id: str) -> str:
+    """Redis key holding a session hash"""
+    return f"{SESSION_KEY_PREFIX}{session_id}"
+
+def get_redis() -> Optional[redis.Redis]:
+    """Shared Redis client, or None when sessions are kept in memory"""
+    return getattr(app.state, "redis", None)
+
+def serialize_session(session: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten a session into Redis hash fields"""
+    return {
+        "messages": pickle.dumps(session["messages"]),
+        "state": pickle.dumps(session["agent_state"]["messages"]),
+        "created_at": session["created_at"].isoformat(),
+        "last_activity": session["last_activity"].isoformat(),
+        "message_count": session["message_count"]
+    }
+
+def deserialize_session(data: Dict[bytes, bytes]) -> Dict[str, Any]:
+    """Rebuild a session from Redis hash fields"""
+    return {
+        "messages": pickle.loads(data[b"messages"]),
+        "agent_state": {"messages": pickle.loads(data[b"state"])},
+        "created_at": datetime.fromisoformat(data[b"created_at"].decode()),
+        "last_activity": datetime.fromisoformat(data[b"last_activity"].decode()),
+        "message_count": int(data[b"message_count"])
+    }
+
+async def load_session(session_id: str) -> Optional[Dict[str, Any]]:
+    """Load a session, or None if it does not exist"""
+    r = get_redis()
+    if r is None:
+        return chat_sessions.get(session_id)
+    
+    data = await r.hgetall(session_key(session_id))
+    return deserialize_session(data) if data else None
+
+async def save_session(session_id: str, session: Dict[str, Any]) -> None:
+    """Persist a session and refresh its expiry"""
+    r = get_redis()
+    if r is None:
+        chat_sessions[session_id] = session
+        return
+    
+    key = session_key(session_id)
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping=serialize_session(session))
+        pipe.expire(key, SESSION_TTL_SECONDS)
+        await pipe.execute()
+
+async def touch_session(session_id: str, session: Dict[str, Any], now: datetime) -> None:
+    """Record activity on a session and refresh its expiry"""
+    session["last_activity"] = now
+    r = get_redis()
+    if r is None:
+        # Re-inserting restarts the TTLCache timer
+        chat_sessions[session_id] = session
+        return
     
+    # EXPIRE first: it is a no-op on a key that expired since it was loaded,
+    # whereas HSET would recreate it as a hash holding only last_activity
+    key = session_key(session_id)
+    if await r.expire(key, SESSION_TTL_SECONDS):
+        await r.hset(key, "last_activity", session["last_activity"].isoformat())
+
+async def load_session_info(session_id: str) -> Optional[SessionInfo]:
+    """Load session metadata without deserializing the message history"""
+    r = get_redis()
+    if r is None:
+        session = chat_sessions.get(session_id)
+        if session is None:
+            return None
+        created_at, last_activity, message_count = (
+            session["created_at"], session["last_activity"], session["message_count"]
+        )
+    else:
+        created_at, last_activity, message_count = await r.hmget(
+            session_key(session_id), "created_at", "last_activity", "message_count"
+        )
+        if created_at is None:
+            return None
+        created_at = datetime.fromisoformat(created_at.decode())
+        last_activity = datetime.fromisoformat(last_activity.decode())
+        message_count = int(message_count)
+    
+    return SessionInfo(
+        session_id=session_id,
+        created_at=created_at,
+        message_count=message_count,
+        last_activity=last_activity
+    )
+
+async def delete_session_data(session_id: str) -> bool:
+    """Delete a session, returning False if it did not exist"""
+    r = get_redis()
+    if r is None:
+        return chat_sessions.pop(session_id, None) is not None
+    
+    return await r.delete(session_key(session_id)) > 0
+
+async def list_session_ids(cursor: int, limit: int) -> Tuple[List[str], Optional[int]]:
+    """One page of stored session IDs and the cursor of the next page (None when done)"""
+    r = get_redis()
+    if r is None:
+        chat_sessions.expire()
+        session_ids = list(islice(chat_sessions, cursor, cursor + limit))
+        next_cursor = cursor + limit if len(chat_sessions) > cursor + limit else None
+        return session_ids, next_cursor
+    
+    # SCAN's count is only a hint, so a page may hold more or fewer than limit
+    next_cursor, keys = await r.scan(cursor=cursor, match=f"{SESSION_KEY_PREFIX}*", count=limit)
+    prefix_len = len(SESSION_KEY_PREFIX)
+    return [key.decode()[prefix_len:] for key in keys], next_cursor or None
+
+@asynccontextmanager
+async def session_lock(session_id: str):
+    """Lock guarding a session's read-modify-write cycle
+    
+    The asyncio lock serializes requests within this worker; with Redis, a
+    Redis lock does the same across workers, since save_session overwrites
+    the whole hash and the last writer would otherwise drop a turn.
+    """
+    async with session_locks[session_id]:
+        r = get_redis()
+        if r is None:
+            yield
+            return
+        
+        lock = r.lock(
+            f"{SESSION_LOCK_KEY_PREFIX}{session_id}",
+            timeout=SESSION_LOCK_TIMEOUT_SECONDS,
+            blocking_timeout=SESSION_LOCK_TIMEOUT_SECONDS
+        )
+        if not await lock.acquire():
+            raise RuntimeError(f"Session {session_id} is busy in another worker")
+        try:
+            yield
+        finally:
+            try:
+                await lock.release()
+            except LockError:
+                logger.warning(f"Redis lock for session {session_id} expired before release")
+
+@asynccontextmanager
+async def open_session(session_id: Optional[str], now: datetime):
+    """Get existing session or create new one, holding the lock of the
+    resolved session ID until the block exits"""
+    if session_id:
+        async with session_lock(session_id):
+            session = await load_session(session_id)
+            if session is not None:
+                await touch_session(session_id, session, now)
+                yield session_id, session
+                return
+    
+    # Unknown or expired ID: start a new session under its own lock, since
+    # /chat/stream hands the new ID to the client before the turn finishes
     new_session_id = create_session_id()
-    chat_sessions[new_session_id] = {
-        "messages": [],
-        "agent_state": {"messages": []},
-        "created_at": datetime.now(),
-        "last_activity": datetime.now(),
-        "message_count": 0
-    }
-    return new_session_id
+    async with session_lock(new_session_id):
+        session = _SESSION_TEMPLATE.copy()
+        session["messages"] = []
+        session["agent_state"] = {"messages": []}
+        session["created_at"] = session["last_activity"] = now
+        await save_session(new_session_id, session)
+        yield new_session_id, session
 
-def determine_sources_used(agent_state: Dict[str, Any]) -> List[str]:
-    """Determine which sources were used in the response"""
-    sources = []
+def determine_sources_used(agent_state: Dict[str, Any], start: int = 0) -> List[str]:
+    """Determine which sources were used in messages[start:] of the agent state"""
+    sources = set()
     messages = agent_state.get("messages", [])
     
-    for message in messages:
-        if hasattr(message, 'tool_calls') and message.tool_calls:
-            for tool_call in message.tool_calls:
-                if tool_call.name == "pdf_search":
-                    sources.append("PDF Documents")
-                elif tool_call.name == "web_search":
-                    sources.append("Web Search")
+    for message in islice(messages, start, None):
+        for tool_call in getattr(message, "tool_calls", None) or ():
+            source = TOOL_SOURCES.get(tool_call["name"])
+            if source:
+                sources.add(source)
+        if len(sources) == len(TOOL_SOURCES):
+            break
     
-    return list(set(sources))  # Remove duplicates
+    return list(sources)
+
+def begin_turn(session: Dict[str, Any], message: str, now: datetime) -> Tuple[Dict[str, Any], int]:
+    """Record the user's message; return the graph input and the index where this turn starts"""
+    # Stored as plain dicts; ChatMessage validation happens once when
+    # /sessions/{id}/messages serializes them
+    session["messages"].append({
+        "role": "user",
+        "content": message,
+        "timestamp": now
+    })
+    session["agent_state"]["messages"].append(HumanMessage(content=message))
+    turn_start = len(session["agent_state"]["messages"]) - 1
+    
+    # The graph mutates its input, so hand it a copy of the history
+    return {"messages": list(session["agent_state"]["messages"])}, turn_start
+
+async def complete_turn(session_id: str, session: Dict[str, Any], turn_start: int,
+                        response: Dict[str, Any], now: datetime) -> Tuple[str, List[str]]:
+    """Store the agent's final state and reply; return the reply and sources used"""
+    # Extract AI response
+    latest_message = response["messages"][-1]
+    if hasattr(latest_message, 'content'):
+        bot_response = latest_message.content
+    else:
+        bot_response = str(latest_message)
+    
+    # Update session
+    session["agent_state"] = response
+    session["message_count"] += 1
+    session["last_activity"] = now
+    
+    # Add bot message to session
+    session["messages"].append({
+        "role": "assistant",
+        "content": bot_response,
+        "timestamp": now
+    })
+    await save_session(session_id, session)
+    
+    # Determine sources used by this turn only (from the user message on)
+    sources_used = determine_sources_used(response, start=turn_start)
+    return bot_response, sources_used
 
 # API Routes
 @app.get("/", response_model=HealthCheck)
@@ -127,143 +362,198 @@ async def health_check():
 async def chat(request: ChatRequest):
     """Main chat endpoint"""
     try:
+        # One timestamp when the request arrives and one when the agent finishes
+        now = datetime.now()
         # Get or create session
-        session_id = get_or_create_session(request.session_id)
-        session = chat_sessions[session_id]
-        
-        # Add user message to session
-        user_message = ChatMessage(
-            role="user",
-            content=request.message,
-            timestamp=datetime.now()
-        )
-        session["messages"].append(user_message.dict())
-        
-        # Add to agent state
-        session["agent_state"]["messages"].append(HumanMessage(content=request.message))
+        async with open_session(request.session_id, now) as (session_id, session):
+            agent_input, turn_start = begin_turn(session, request.message, now)
         
-        # Get response from agent
-        logger.info(f"Processing message for session {session_id}: {request.message}")
+            # Get response from agent
+            logger.info(f"Processing message for session {session_id}: {request.message}")
         
-        response = agent_app.invoke(session["agent_state"])
+            # The graph is synchronous, so run it in a worker thread; the
+            # session is only updated back on the event loop
+            response = await asyncio.to_thread(agent_app.invoke, agent_input)
+            now = datetime.now()
+            bot_response, sources_used = await complete_turn(session_id, session, turn_start, response, now)
         
-        # Extract AI response
-        latest_message = response["messages"][-1]
-        if hasattr(latest_message, 'content'):
-            bot_response = latest_message.content
-        else:
-            bot_response = str(latest_message)
+            logger.info(f"Response generated for session {session_id}")
         
-        # Update session
-        session["agent_state"] = response
-        session["message_count"] += 1
-        session["last_activity"] = datetime.now()
-        
-        # Add bot message to session
-        bot_message = ChatMessage(
-            role="assistant",
-            content=bot_response,
-            timestamp=datetime.now()
-        )
-        session["messages"].append(bot_message.dict())
-        
-        # Determine sources used
-        sources_used = determine_sources_used(response)
-        
-        logger.info(f"Response generated for session {session_id}")
-        
-        return ChatResponse(
-            response=bot_response,
-            session_id=session_id,
-            timestamp=datetime.now(),
-            sources_used=sources_used
-        )
+            return ChatResponse(
+                response=bot_response,
+                session_id=session_id,
+                timestamp=now,
+                sources_used=sources_used
+            )
         
     except Exception as e:
         logger.error(f"Error processing chat request: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+def sse_event(data: Any, event: Optional[str] = None) -> str:
+    """Format one Server-Sent Event with a JSON payload"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Chat endpoint streaming LLM tokens as Server-Sent Events
+    
+    Emits a `session` event with the session ID, one unnamed event per token,
+    then a `done` event with the full response and sources used (or an
+    `error` event).
+    """
+    async def event_generator():
+        try:
+            now = datetime.now()
+            async with open_session(request.session_id, now) as (session_id, session):
+                agent_input, turn_start = begin_turn(session, request.message, now)
+                yield sse_event({"session_id": session_id}, event="session")
+                
+                logger.info(f"Streaming response for session {session_id}: {request.message}")
+                
+                response = None
+                async for ev in agent_app.astream_events(agent_input, version="v2"):
+                    if ev["event"] == "on_chat_model_stream":
+                        token = ev["data"]["chunk"].content
+                        if token:
+                            yield sse_event(token)
+                    elif ev["event"] == "on_chain_end" and not ev["parent_ids"]:
+                        # End of the top-level graph run carries the final state
+                        response = ev["data"]["output"]
+                
+                if response is None:
+                    raise RuntimeError("Agent finished without returning a state")
+                
+                # Persist only after the stream completes
+                bot_response, sources_used = await complete_turn(
+                    session_id, session, turn_start, response, datetime.now()
+                )
+                # Includes the full reply: cache hits and error fallbacks emit no tokens
+                yield sse_event({"response": bot_response, "sources_used": sources_used}, event="done")
+                
+                logger.info(f"Streamed response for session {session_id}")
+        
+        except Exception as e:
+            logger.error(f"Error streaming chat request: {str(e)}")
+            yield sse_event({"detail": f"Internal server error: {str(e)}"}, event="error")
+    
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
 @app.get("/sessions/{session_id}", response_model=SessionInfo)
 async def get_session_info(session_id: str):
     """Get session information"""
-    if session_id not in chat_sessions:
+    session_info = await load_session_info(session_id)
+    if session_info is None:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    session = chat_sessions[session_id]
-    return SessionInfo(
-        session_id=session_id,
-        created_at=session["created_at"],
-        message_count=session["message_count"],
-        last_activity=session["last_activity"]
-    )
+    return session_info
 
 @app.get("/sessions/{session_id}/messages", response_model=List[ChatMessage])
 async def get_session_messages(session_id: str):
     """Get all messages from a session"""
-    if session_id not in chat_sessions:
+    session = await load_session(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    return chat_sessions[session_id]["messages"]
+    return session["messages"]
 
 @app.delete("/sessions/{session_id}")
 async def delete_session(session_id: str):
     """Delete a chat session"""
-    if session_id not in chat_sessions:
+    async with session_lock(session_id):
+        deleted = await delete_session_data(session_id)
+    if not deleted:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    del chat_sessions[session_id]
     return {"message": f"Session {session_id} deleted successfully"}
 
-@app.get("/sessions", response_model=List[SessionInfo])
-async def list_sessions():
-    """List all active sessions"""
-    sessions = []
-    for session_id, session_data in chat_sessions.items():
-        sessions.append(SessionInfo(
-            session_id=session_id,
-            created_at=session_data["created_at"],
-            message_count=session_data["message_count"],
-            last_activity=session_data["last_activity"]
-        ))
-    return sessions
+@app.get("/sessions", response_model=SessionPage)
+async def list_sessions(cursor: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=500)):
+    """List active sessions a page at a time; pass `next_cursor` back as `cursor`"""
+    session_ids, next_cursor = await list_session_ids(cursor, limit)
+    session_infos = await asyncio.gather(*(load_session_info(sid) for sid in session_ids))
+    return SessionPage(
+        # Redis keys can expire between SCAN and HMGET
+        items=[info for info in session_infos if info is not None],
+        next_cursor=next_cursor
+    )
 
 @app.post("/sessions/{session_id}/clear")
 async def clear_session(session_id: str):
     """Clear all messages from a session"""
-    if session_id not in chat_sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    chat_sessions[session_id]["messages"] = []
-    chat_sessions[session_id]["agent_state"] = {"messages": []}
-    chat_sessions[session_id]["message_count"] = 0
+    async with session_lock(session_id):
+        session = await load_session(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        
+        session["messages"] = []
+        session["agent_state"] = {"messages": []}
+        session["message_count"] = 0
+        await save_session(session_id, session)
     
     return {"message": f"Session {session_id} cleared successfully"}
 
-# Background task to clean up old sessions
-async def cleanup_old_sessions():
-    """Clean up sessions older than 24 hours"""
-    current_time = datetime.now()
-    sessions_to_delete = []
-    
-    for session_id, session_data in chat_sessions.items():
-        time_diff = current_time - session_data["last_activity"]
-        if time_diff.total_seconds() > 24 * 3600:  # 24 hours
-            sessions_to_delete.append(session_id)
-    
-    for session_id in sessions_to_delete:
-        del chat_sessions[session_id]
+# Background task to drop locks of sessions that have expired or been deleted
+async def prune_session_locks():
+    """Drop locks of sessions that no longer exist"""
+    locks_pruned = 0
+    for session_id in list(session_locks):
+        if await load_session_info(session_id) is not None:
+            continue
+        # Re-check after the await: the lock may have been taken meanwhile
+        lock = session_locks.get(session_id)
+        if lock is not None and not lock.locked():
+            del session_locks[session_id]
+            locks_pruned += 1
     
-    logger.info(f"Cleaned up {len(sessions_to_delete)} old sessions")
+    logger.info(f"Pruned {locks_pruned} idle session locks")
+
+async def run_session_lock_pruning():
+    """Run prune_session_locks periodically"""
+    while True:
+        await asyncio.sleep(SESSION_LOCK_PRUNE_INTERVAL_SECONDS)
+        try:
+            await prune_session_locks()
+        except Exception as e:
+            logger.error(f"Session lock pruning failed: {str(e)}")
+
+async def warm_up():
+    """Enable the LLM cache, load the vector store and run the graph once so the
+    first real request doesn't pay cold-start costs"""
+    try:
+        if await asyncio.to_thread(enable_llm_cache):
+            logger.info("LLM response cache enabled")
+        await asyncio.to_thread(get_retriever)
+        logger.info("Retriever loaded")
+        await asyncio.to_thread(agent_app.invoke, {"messages": [HumanMessage(content="ping")]})
+        logger.info("Agent graph warmed up")
+    except Exception as e:
+        logger.warning(f"Warm-up failed: {str(e)}")
 
 # Startup event
 @app.on_event("startup")
 async def startup_event():
+    if REDIS_URL:
+        app.state.redis = redis.Redis.from_url(REDIS_URL)
+        await app.state.redis.ping()
+        logger.info("Using Redis session store")
+    else:
+        app.state.redis = None
+        logger.info("REDIS_URL not set, using in-memory session store")
+    app.state.lock_pruning_task = asyncio.create_task(run_session_lock_pruning())
+    # Warm up in the background so the server answers health checks right away
+    app.state.warm_up_task = asyncio.create_task(warm_up())
     logger.info("🚀 Travel Chatbot API started successfully!")
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("🛑 Travel Chatbot API shutting down...")
+    app.state.lock_pruning_task.cancel()
+    app.state.warm_up_task.cancel()
+    if get_redis() is not None:
+        await app.state.redis.aclose()
 
 if __name__ == "__main__":
     import uvicorn
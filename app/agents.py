@@ -47,24 +47,28 @@ def tool_node(state: GraphState) -> GraphState:
    last_msg = messages[-1]
    tool_outputs = []
 
+   # Tool calls are ToolCall dicts, not objects
    for call in getattr(last_msg, "tool_calls", []):
-       tool = tool_map[call.name]
+       tool = tool_map.get(call["name"])
+       if tool is None:
+           tool_outputs.append(ToolMessage(tool_call_id=call["id"], content=f"Unknown tool: {call['name']}"))
+           continue
        
        # Get the query from tool call arguments
-       if hasattr(call, 'args'):
-           if isinstance(call.args, dict):
-               query = call.args.get("query", call.args.get("__arg1", str(call.args)))
-           else:
-               query = str(call.args)
+       args = call.get("args")
+       if isinstance(args, dict):
+           query = args.get("query", args.get("__arg1", str(args)))
+       elif args:
+           query = str(args)
        else:
            query = "general search"
        
        try:
            result = tool.func(query)
-           tool_outputs.append(ToolMessage(tool_call_id=call.id, content=result))
+           tool_outputs.append(ToolMessage(tool_call_id=call["id"], content=result))
        except Exception as e:
            error_msg = f"Tool {tool.name} failed: {e}"
-           tool_outputs.append(ToolMessage(tool_call_id=call.id, content=error_msg))
+           tool_outputs.append(ToolMessage(tool_call_id=call["id"], content=error_msg))
 
    messages.extend(tool_outputs)
    return {"messages": messages}
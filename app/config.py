@@ -3,5 +3,12 @@ from dotenv import load_dotenv
 
 load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+REDIS_URL = os.getenv("REDIS_URL")
+LLM_CACHE_REDIS_URL = os.getenv("LLM_CACHE_REDIS_URL")
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", 10000))
 CHROMA_DIR = "./chroma_store"
+CHROMA_HOST = os.getenv("CHROMA_HOST")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", 8000))
+CHROMA_COLLECTION = "travel"
 DOCS_PATH = "./data"
+PARSED_DOCS_CACHE = "./parsed_docs_cache.json"
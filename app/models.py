@@ -1,11 +1,44 @@
 import os
+import logging
+import redis
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
+from langchain_community.cache import RedisCache
+from langchain_core.globals import set_llm_cache
+from app.config import LLM_CACHE_REDIS_URL
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_TTL_SECONDS = 24 * 3600
+
 llm = ChatOpenAI(
     model="gpt-4o-mini",  
     api_key=OPENAI_API_KEY
-)
\ No newline at end of file
+)
+
+
+def enable_llm_cache() -> bool:
+    """Serve repeated prompts from Redis instead of calling the LLM again.
+
+    Opt-in via LLM_CACHE_REDIS_URL. The cache is exact-match on the full prompt
+    (conversation history, tool messages and model settings), so a hit only
+    happens for a byte-identical request. A semantic cache is unsafe here: the
+    serialized history overflows the embedder's 512-token window, so different
+    turns, or a ReAct step before and after a tool result, embed identically
+    and replay the wrong generation.
+    """
+    if not LLM_CACHE_REDIS_URL:
+        return False
+
+    client = redis.Redis.from_url(LLM_CACHE_REDIS_URL)
+    try:
+        client.ping()
+    except redis.RedisError as e:
+        logger.warning(f"LLM cache disabled, cannot reach Redis: {e}")
+        return False
+
+    set_llm_cache(RedisCache(redis_=client, ttl=LLM_CACHE_TTL_SECONDS))
+    return True
@@ -1,34 +1,136 @@
 
 import os
-from langchain_community.document_loaders import DirectoryLoader, PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import glob
+import json
+import hashlib
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import torch
+from langchain_community.document_loaders import PyPDFium2Loader
+from langchain_core.documents import Document
+from langchain.text_splitter import TokenTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
-from app.config import CHROMA_DIR, DOCS_PATH
+import chromadb
+from app.config import (
+    CHROMA_DIR, CHROMA_HOST, CHROMA_PORT, CHROMA_COLLECTION, DOCS_PATH, PARSED_DOCS_CACHE
+)
+
+# HNSW graph parameters, applied when a collection is created
+HNSW_METADATA = {"hnsw:M": 32, "hnsw:construction_ef": 200, "hnsw:search_ef": 64}
+
+
+def load_pdf(file_path: str):
+    return PyPDFium2Loader(file_path).load()
 
 
 def load_documents(path: str = DOCS_PATH):
-    loader = DirectoryLoader(path, glob="**/*.pdf", loader_cls=PyPDFLoader)
-    return loader.load()
+    # Parsed pages are cached on disk and reused while the PDF set is unchanged
+    pdf_files = sorted(glob.glob(os.path.join(path, "**", "*.pdf"), recursive=True))
+    fingerprint = [[f, os.path.getmtime(f)] for f in pdf_files]
+    if os.path.exists(PARSED_DOCS_CACHE):
+        with open(PARSED_DOCS_CACHE) as f:
+            cached = json.load(f)
+        if cached["fingerprint"] == fingerprint:
+            print("Using cached parsed documents.")
+            return [Document(**doc) for doc in cached["documents"]]
+
+    # PDFium is not thread-safe, so parse in parallel processes, one file each.
+    # "spawn" avoids forking a process that already runs server threads.
+    if len(pdf_files) > 1:
+        with ProcessPoolExecutor(
+            max_workers=min(len(pdf_files), os.cpu_count() or 1),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as pool:
+            docs = [doc for file_docs in pool.map(load_pdf, pdf_files) for doc in file_docs]
+    else:
+        docs = [doc for pdf_file in pdf_files for doc in load_pdf(pdf_file)]
+
+    # Write then rename so workers building concurrently never read a partial file
+    tmp_path = f"{PARSED_DOCS_CACHE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({
+            "fingerprint": fingerprint,
+            "documents": [
+                {"page_content": doc.page_content, "metadata": doc.metadata}
+                for doc in docs
+            ],
+        }, f)
+    os.replace(tmp_path, PARSED_DOCS_CACHE)
+    return docs
 
 
 def split_documents(documents):
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=512,
-        chunk_overlap=64,
-        separators=["\n\n", "\n", ".", " ", ""],
+    # Sizes are in tiktoken tokens: 128 tokens is roughly the old 512-character
+    # chunk and stays well inside BGE's 512-token input limit
+    splitter = TokenTextSplitter(
+        encoding_name="cl100k_base",
+        chunk_size=128,
+        chunk_overlap=16,
     )
     return splitter.split_documents(documents)
 
 
+@functools.lru_cache(maxsize=1)
 def get_embedding_model():
+    # Cached so the model loads once per process however many callers need it
+    # Half precision only pays off on GPU; CPU kernels are slower in FP16
+    if torch.cuda.is_available():
+        model_kwargs = {"device": "cuda", "model_kwargs": {"torch_dtype": torch.float16}}
+    else:
+        model_kwargs = {"device": "cpu"}
     return HuggingFaceEmbeddings(
         model_name="BAAI/bge-small-en-v1.5",
-        encode_kwargs={"normalize_embeddings": True},
+        model_kwargs=model_kwargs,
+        encode_kwargs={"batch_size": 128, "normalize_embeddings": True},
+    )
+
+
+def load_chunks():
+    print("Loading documents...")
+    docs = load_documents()
+    print(f"Loaded {len(docs)} documents.")
+
+    print("Splitting into chunks...")
+    return split_documents(docs)
+
+
+def chunk_id(chunk) -> str:
+    key = f"{chunk.metadata.get('source')}|{chunk.metadata.get('page')}|{chunk.page_content}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def connect_vectorstore():
+    # Shared Chroma server: one index for every worker process
+    chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+    collection = chroma_client.get_or_create_collection(
+        CHROMA_COLLECTION, metadata=HNSW_METADATA
     )
+    vectordb = Chroma(
+        client=chroma_client,
+        collection_name=CHROMA_COLLECTION,
+        embedding_function=get_embedding_model(),
+    )
+    # Chunk ids are deterministic and writes are upserts, so workers ingesting
+    # concurrently or a retry after a partial ingest never duplicate chunks
+    chunks_by_id = {chunk_id(chunk): chunk for chunk in load_chunks()}
+    existing_ids = set(collection.get(ids=list(chunks_by_id), include=[])["ids"])
+    missing_ids = [i for i in chunks_by_id if i not in existing_ids]
+    if missing_ids:
+        print(f"Adding {len(missing_ids)} chunks to the Chroma server...")
+        vectordb.add_documents([chunks_by_id[i] for i in missing_ids], ids=missing_ids)
+        print("Vectorstore built on the Chroma server.")
+    else:
+        print(f"Using Chroma server collection '{CHROMA_COLLECTION}'.")
+    return vectordb
 
 
 def build_or_load_vectorstore():
+    if CHROMA_HOST:
+        return connect_vectorstore()
+
     if os.path.exists(CHROMA_DIR) and os.listdir(CHROMA_DIR):
         print("Vectorstore already exists. Loading from disk...")
         embedding_model = get_embedding_model()
@@ -37,19 +139,15 @@ def build_or_load_vectorstore():
             embedding_function=embedding_model,
         )
     else:
-        print("Loading documents...")
-        docs = load_documents()
-        print(f"Loaded {len(docs)} documents.")
-
-        print("Splitting into chunks...")
-        chunks = split_documents(docs)
+        chunks = load_chunks()
 
         print("Creating embeddings and vector store...")
         embedding_model = get_embedding_model()
         vectordb = Chroma.from_documents(
             documents=chunks,
             embedding=embedding_model,
-            persist_directory=CHROMA_DIR
+            persist_directory=CHROMA_DIR,
+            collection_metadata=HNSW_METADATA,
         )
 
         print("Vectorstore built and saved.")
@@ -57,9 +155,21 @@ def build_or_load_vectorstore():
     return vectordb
 
 
+_retriever = None
+_retriever_lock = threading.Lock()
+
+
 def get_retriever():
-    vectordb = build_or_load_vectorstore()
-    return vectordb.as_retriever(
-        search_type="similarity",
-        search_kwargs={"k": 5}
-    )
+    # Built on first use; the lock keeps concurrent first calls (warm-up thread
+    # and early requests) from loading the vector store twice
+    global _retriever
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                vectordb = build_or_load_vectorstore()
+                # MMR re-ranks the 20 nearest chunks for diversity before keeping 5
+                _retriever = vectordb.as_retriever(
+                    search_type="mmr",
+                    search_kwargs={"k": 5, "fetch_k": 20}
+                )
+    return _retriever
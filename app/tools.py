@@ -2,19 +2,73 @@
 from langchain.tools import Tool
 from langchain_community.tools import DuckDuckGoSearchRun
 import os
+import hashlib
+import logging
+from functools import wraps
+import redis
 from dotenv import load_dotenv
+from app.config import REDIS_URL
 from app.retriever import get_retriever
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
-retriever = get_retriever()
+redis_client = redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
 
-def pdf_search(query: str) -> str:
-    docs = retriever.get_relevant_documents(query)
-    if not docs:
+def redis_cache(prefix: str, ttl: int):
+    """Memoize a query -> str tool function in Redis for ttl seconds."""
+    def decorator(func):
+        if redis_client is None:
+            return func
+
+        def cache_key(query: str) -> str:
+            return f"{prefix}:" + hashlib.sha1(query.encode()).hexdigest()
+
+        # Fails open: a Redis error is logged and the tool runs uncached
+        @wraps(func)
+        def wrapper(query: str) -> str:
+            key = cache_key(query)
+            try:
+                cached = redis_client.get(key)
+            except redis.RedisError as e:
+                logger.warning(f"Tool cache read failed for {prefix}: {e}")
+                return func(query)
+            if cached is not None:
+                return cached.decode()
+            result = func(query)
+            try:
+                redis_client.setex(key, ttl, result)
+            except redis.RedisError as e:
+                logger.warning(f"Tool cache write failed for {prefix}: {e}")
+            return result
+
+        return wrapper
+    return decorator
+
+
+# Upper bound on PDF text handed back to the LLM per search
+PDF_SEARCH_MAX_CHARS = 4000
+
+def format_docs(docs, max_chars: int = PDF_SEARCH_MAX_CHARS) -> str:
+    parts = []
+    remaining = max_chars
+    for doc in docs:
+        content = doc.page_content
+        if len(content) > remaining:
+            # Keep the head of the chunk that crosses the budget, then stop
+            if remaining > 0:
+                parts.append(content[:remaining])
+            break
+        parts.append(content)
+        remaining -= len(content) + 2  # "\n\n" separator
+    if not parts:
         return "No relevant documents found in the PDF database."
-    return "\n\n".join([doc.page_content for doc in docs])
+    return "\n\n".join(parts)
+
+@redis_cache("pdf", 3600)
+def pdf_search(query: str) -> str:
+    return format_docs(get_retriever().invoke(query))
 
 pdf_search_tool = Tool(
     name="pdf_search",
@@ -25,6 +79,7 @@ pdf_search_tool = Tool(
 
 duckduckgo = DuckDuckGoSearchRun()
 
+@redis_cache("web", 600)
 def web_search(query: str) -> str:
     result = duckduckgo.run(query)
     return result if result else "No web results found."